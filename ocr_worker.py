@@ -0,0 +1,182 @@
+"""OCR side of the document parser: image preprocessing, PDF rendering and Tesseract.
+
+Runs inside the OCR worker processes. Kept apart from server.py so the spawned
+workers import only this module, not the Flask app with its thread and
+process pools.
+"""
+
+import os
+import sys
+
+# Keep each Tesseract single-threaded: OpenMP inside concurrent OCR calls only
+# oversubscribes the cores, parallelism comes from the OCR process pool instead
+os.environ.setdefault("OMP_THREAD_LIMIT", "1")
+os.environ.setdefault("OMP_NUM_THREADS", os.environ["OMP_THREAD_LIMIT"])
+
+# Set paths before importing pytesseract
+# Check if running in Docker or Windows
+if sys.platform == "win32":
+    os.environ["TESSDATA_PREFIX"] = r"C:\tools\tesseract\tessdata"
+else:
+    # Linux/Docker environment
+    os.environ["TESSDATA_PREFIX"] = os.getenv("TESSDATA_PREFIX", "/usr/share/tesseract-ocr/5/tessdata/")
+
+import pytesseract
+from PIL import Image, ImageOps
+import pypdfium2 as pdfium
+import threading
+import weakref
+
+try:
+    # In-process libtesseract bindings: no subprocess or model reload per page
+    import tesserocr
+except ImportError:
+    tesserocr = None
+
+# Set tesseract command path based on platform
+if sys.platform == "win32":
+    pytesseract.pytesseract.tesseract_cmd = r"C:\tools\tesseract\tesseract.exe"
+else:
+    # In Docker/Linux, tesseract is in PATH
+    pytesseract.pytesseract.tesseract_cmd = "tesseract"
+
+PDF_DPI = int(os.getenv("PDF_DPI", 150))  # PDF rendering resolution for OCR
+PDF_TEXT_MIN_CHARS = int(os.getenv("PDF_TEXT_MIN_CHARS", 50))  # Embedded text needed to skip OCR on a page
+
+OCR_LANG = "rus"
+OCR_CONFIG = "--psm 3 --oem 1"  # Faster OCR mode (pytesseract fallback only)
+
+# libtesseract API objects are not thread-safe, so each worker thread gets its own
+_tess_local = threading.local()
+
+
+def get_tess_api():
+    """Return this thread's tesserocr API, initializing the model on first use"""
+    api = getattr(_tess_local, "api", None)
+    if api is None:
+        api = tesserocr.PyTessBaseAPI(
+            path=os.environ["TESSDATA_PREFIX"],
+            lang=OCR_LANG,
+            psm=tesserocr.PSM.AUTO,
+            oem=tesserocr.OEM.LSTM_ONLY,
+        )
+        weakref.finalize(api, api.End)
+        _tess_local.api = api
+    return api
+
+
+def ocr_image(img):
+    """Run OCR on a PIL image, in-process when tesserocr is available"""
+    if tesserocr is None:
+        return pytesseract.image_to_string(img, lang=OCR_LANG, config=OCR_CONFIG)
+    api = get_tess_api()
+    api.SetImage(img)
+    try:
+        return api.GetUTF8Text()
+    finally:
+        # The API lives as long as its worker; drop the page image and layout results,
+        # keeping only the loaded model
+        api.Clear()
+
+
+def init_ocr_worker():
+    """Warm up an OCR worker process before it takes its first document.
+
+    Loads the language model and runs a tiny dummy OCR so the LSTM weights
+    are mapped in once per worker instead of during the first upload.
+    """
+    if tesserocr is None:
+        return
+    api = get_tess_api()
+    api.SetImage(Image.new("L", (8, 8), 255))
+    api.GetUTF8Text()
+
+
+def otsu_threshold(img):
+    """Compute Otsu's binarization threshold from an 8-bit image histogram"""
+    hist = img.histogram()
+    total = sum(hist)
+    sum_all = sum(level * count for level, count in enumerate(hist))
+    sum_bg = weight_bg = 0
+    best_threshold, best_variance = 0, 0.0
+    for level, count in enumerate(hist):
+        weight_bg += count
+        weight_fg = total - weight_bg
+        if weight_bg == 0:
+            continue
+        if weight_fg == 0:
+            break
+        sum_bg += level * count
+        mean_diff = sum_bg / weight_bg - (sum_all - sum_bg) / weight_fg
+        variance = weight_bg * weight_fg * mean_diff * mean_diff
+        if variance > best_variance:
+            best_threshold, best_variance = level, variance
+    return best_threshold
+
+
+def crop_to_text(img, padding=10, max_area_ratio=0.7):
+    """Crop a binarized page to the bounding box of its dark pixels.
+
+    Margins and blank areas cost Tesseract time without yielding text. The
+    crop is skipped when it would keep most of the page anyway.
+    """
+    bbox = ImageOps.invert(img).getbbox()
+    if bbox is None:
+        return img
+    left, top, right, bottom = bbox
+    left, top = max(left - padding, 0), max(top - padding, 0)
+    right, bottom = min(right + padding, img.width), min(bottom + padding, img.height)
+    if (right - left) * (bottom - top) > max_area_ratio * img.width * img.height:
+        return img
+    return img.crop((left, top, right, bottom))
+
+
+def optimize_image(img, max_size=2000):
+    """Grayscale, resize, binarize and crop image so Tesseract can skip its own preprocessing"""
+    if img.format == "JPEG":
+        # Let libjpeg decode straight to grayscale at a reduced scale when the
+        # photo is at least twice the target size
+        img.draft("L", (max_size, max_size))
+    # Convert first so the resize only touches one channel
+    if img.mode != "L":
+        img = img.convert("L")
+    if max(img.size) > max_size:
+        img.thumbnail((max_size, max_size), Image.Resampling.LANCZOS)
+    threshold = otsu_threshold(img)
+    img = img.point([0 if level <= threshold else 255 for level in range(256)])
+    return crop_to_text(img)
+
+
+def ocr_image_file(path):
+    """OCR an uploaded image file (runs in an OCR worker process)"""
+    with Image.open(path) as img:
+        return ocr_image(optimize_image(img))
+
+
+def pdf_page_text(page):
+    """Return the embedded text layer of a PDF page (empty for scans)"""
+    textpage = page.get_textpage()
+    try:
+        return textpage.get_text_bounded()
+    finally:
+        textpage.close()
+
+
+def ocr_pdf_page(path, index):
+    """Read one page of a PDF file (runs in an OCR worker process).
+
+    Pages exported from a word processor carry their text, which is used as
+    is; only pages without enough embedded text are rendered and OCRed.
+    Returns None when the PDF has no page at that index.
+    """
+    pdf = pdfium.PdfDocument(path)
+    try:
+        if index >= len(pdf):
+            return None
+        page = pdf[index]
+        text = pdf_page_text(page)
+        if len(text.strip()) >= PDF_TEXT_MIN_CHARS:
+            return text
+        return ocr_image(optimize_image(page.render(scale=PDF_DPI / 72, grayscale=True).to_pil()))
+    finally:
+        pdf.close()
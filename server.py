@@ -1,33 +1,30 @@
 import os
-import sys
-
-# Set paths before importing pytesseract
-# Check if running in Docker or Windows
-if sys.platform == "win32":
-    os.environ["TESSDATA_PREFIX"] = r"C:\tools\tesseract\tessdata"
-else:
-    # Linux/Docker environment
-    os.environ["TESSDATA_PREFIX"] = os.getenv("TESSDATA_PREFIX", "/usr/share/tesseract-ocr/5/tessdata/")
-
-import pytesseract
-from PIL import Image
-from pdf2image import convert_from_bytes
-from flask import Flask, request, jsonify, send_file, send_from_directory
+
+from flask import Flask, Response, abort, jsonify, make_response, request, send_from_directory
 from werkzeug.utils import secure_filename
 from flask_cors import CORS
-import io
 import zipfile
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed, wait
+from concurrent.futures.process import BrokenProcessPool
+from collections import OrderedDict, deque
+import hashlib
 import logging
+import multiprocessing
+import re
 import tempfile
+import threading
+import time
+
+# Image preprocessing and Tesseract live in their own module, which is all the
+# OCR worker processes import
+from ocr_worker import init_ocr_worker, ocr_image_file, ocr_pdf_page
+
+try:
+    # C automaton that finds every category keyword in one pass over the text
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
 
-# Set tesseract command path based on platform
-if sys.platform == "win32":
-    pytesseract.pytesseract.tesseract_cmd = r"C:\tools\tesseract\tesseract.exe"
-else:
-    # In Docker/Linux, tesseract is in PATH
-    pytesseract.pytesseract.tesseract_cmd = "tesseract"
 app = Flask(__name__)
 CORS(app)
 UPLOAD_FOLDER = "uploads"
@@ -40,9 +37,24 @@ logger = logging.getLogger(__name__)
 # Configuration: limits and settings (can be overridden with env vars)
 MAX_FILE_SIZE = int(os.getenv("MAX_FILE_SIZE", 100 * 1024 * 1024))  # 50 MB per file
 MAX_REQUEST_SIZE = int(os.getenv("MAX_REQUEST_SIZE", 500 * 1024 * 1024))  # 500 MB total
-
-# Thread pool for parallel processing
-MAX_WORKERS = min(4, os.cpu_count() or 1)
+# Werkzeug rejects larger bodies before the multipart form is parsed
+app.config["MAX_CONTENT_LENGTH"] = MAX_REQUEST_SIZE
+UPLOAD_CHUNK_SIZE = 1024 * 1024  # 1 MB reads when spooling uploads to disk
+# Spool files older than this at startup were left behind by a killed worker
+STALE_UPLOAD_AGE = int(os.getenv("STALE_UPLOAD_AGE", 3600))  # seconds
+PDF_PAGE_PARALLELISM = int(os.getenv("PDF_PAGE_PARALLELISM", 3))  # PDF pages OCRed at once per file
+
+# Number of OCR processes, each running a single-threaded Tesseract. Every
+# gunicorn worker starts its own pool, so by default the cores are split
+# between the WEB_CONCURRENCY workers (gunicorn's default for --workers)
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", 1))
+OCR_WORKERS = int(os.getenv("OCR_WORKERS", max((os.cpu_count() or 1) // WEB_CONCURRENCY, 1)))
+
+# Thread pool for parallel processing (file I/O and bookkeeping). Each thread
+# submits one document's pages and waits on their OCR results, so sizing it to
+# the OCR pool keeps every OCR process busy without queueing more documents'
+# pages than it can work on; further files wait in the executor queue.
+MAX_WORKERS = OCR_WORKERS
 executor = ThreadPoolExecutor(max_workers=MAX_WORKERS)
 
 CATEGORIES = {
@@ -85,8 +97,79 @@ CATEGORIES = {
     ],
 }
 
+# (lowercased, original) keyword pairs, lowercased once at import
+CATEGORIES_LOWER = {
+    category: tuple((keyword.lower(), keyword) for keyword in keywords) for category, keywords in CATEGORIES.items()
+}
+
 ALLOWED_EXTENSIONS = {"pdf", "jpg", "jpeg", "png"}
 
+# Anything but Unicode letters, digits, "_" and "-" (\w is exactly isalnum() plus "_")
+UNSAFE_NAME_CHARS = re.compile(r"[^\w-]")
+
+
+def build_keyword_automaton(categories_lower):
+    """Compile all category keywords into a single Aho-Corasick automaton.
+
+    Each lowercased keyword maps to the (category, keyword) pairs it stands
+    for, so keywords that only differ in case keep counting separately.
+    """
+    owners = {}
+    for category, keywords in categories_lower.items():
+        for keyword_lower, keyword in keywords:
+            owners.setdefault(keyword_lower, []).append((category, keyword))
+
+    automaton = ahocorasick.Automaton()
+    for keyword_lower, pairs in owners.items():
+        automaton.add_word(keyword_lower, tuple(pairs))
+    automaton.make_automaton()
+    return automaton
+
+
+KEYWORD_AUTOMATON = build_keyword_automaton(CATEGORIES_LOWER) if ahocorasick is not None else None
+
+
+def start_ocr_executor():
+    """Start the process pool for OCR: one single-threaded Tesseract per core.
+
+    Workers are spawned rather than forked since the parent already runs threads.
+    """
+    return ProcessPoolExecutor(
+        max_workers=OCR_WORKERS,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=init_ocr_worker,
+    )
+
+
+# Created on first use rather than at import, so processes that merely import
+# this module never build a pool of their own
+ocr_executor = None
+_ocr_executor_lock = threading.Lock()
+
+
+def submit_ocr(fn, *args):
+    """Submit fn to the OCR pool, replacing the pool if a worker process died.
+
+    A worker killed by the OOM killer or crashing in native code breaks the
+    whole pool: the files in flight at that moment fail, later ones get a
+    fresh pool instead of failing forever.
+    """
+    global ocr_executor
+    pool = ocr_executor
+    if pool is not None:
+        try:
+            return pool.submit(fn, *args)
+        except BrokenProcessPool:
+            pass
+
+    with _ocr_executor_lock:
+        if ocr_executor is pool:
+            if pool is not None:
+                logger.error("OCR process pool is broken, starting a new one")
+                pool.shutdown(wait=False)
+            ocr_executor = start_ocr_executor()
+        return ocr_executor.submit(fn, *args)
+
 
 def allowed_file(filename):
     if not filename:
@@ -95,66 +178,191 @@ def allowed_file(filename):
     return ext in {".pdf", ".jpg", ".jpeg", ".png"}
 
 
-def optimize_image(img, max_size=2000):
-    """Resize image to improve OCR speed while maintaining quality"""
-    if max(img.size) > max_size:
-        img.thumbnail((max_size, max_size), Image.Resampling.LANCZOS)
-    return img
-
-
-def extract_text(file_bytes, ext, max_pages=10):
+def extract_text(path, ext, max_pages=10):
     """
     Extract text with optimizations:
     - Only process first few pages of PDFs
+    - OCR several PDF pages at once across the OCR processes
     - Resize images for faster OCR
     - Use faster OCR config
+
+    Workers read the file from path themselves, so its contents are never
+    pickled across the process boundary.
     """
-    ocr_config = '--psm 3 --oem 1'  # Faster OCR mode
-
-    if ext == ".pdf":
-        # Only convert first few pages for classification
-        images = convert_from_bytes(file_bytes, first_page=1, last_page=max_pages)
-        texts = []
-        for img in images:
-            img = optimize_image(img)
-            text = pytesseract.image_to_string(img, lang="rus", config=ocr_config)
+    if ext != ".pdf":
+        return submit_ocr(ocr_image_file, path).result()
+
+    pages = deque()  # futures of the pages being OCRed, in page order
+    next_index = 0
+    texts = []
+    text_length = 0  # length of "\n".join(texts), tracked without joining
+    matched = {}  # category -> keywords found on the pages so far
+    try:
+        while True:
+            # Keep a few pages ahead in flight; results are consumed in page order
+            while next_index < max_pages and len(pages) < PDF_PAGE_PARALLELISM:
+                pages.append(submit_ocr(ocr_pdf_page, path, next_index))
+                next_index += 1
+            if not pages:
+                break
+            text = pages.popleft().result()
+            if text is None:  # past the last page
+                break
             texts.append(text)
-            # Early exit if we have enough text for classification
-            combined = "\n".join(texts)
-            if len(combined) > 500:  # Enough text to classify
+            text_length += len(text) + (len(texts) > 1)
+            for category, keywords in match_keywords(text.lower()).items():
+                matched.setdefault(category, set()).update(keywords)
+            # Early exit once the category is obvious or we have enough text for classification
+            if has_clear_winner(matched):
                 break
-        return "\n".join(texts)
-    else:
-        img = Image.open(io.BytesIO(file_bytes))
-        img = optimize_image(img)
-        return pytesseract.image_to_string(img, lang="rus", config=ocr_config)
+            if text_length > 500:  # Enough text to classify
+                break
+    finally:
+        # Pages that have not started yet are dropped, running ones finish unused
+        for future in pages:
+            future.cancel()
+        # Workers still reading the file keep it open; wait for them so the
+        # caller can rename or remove it (an open file can't be on Windows)
+        wait(pages)
+    return "\n".join(texts)
+
+
+def match_keywords(text_lower):
+    """Return {category: [matched keywords]} for already lowercased text"""
+    if KEYWORD_AUTOMATON is None:
+        return {
+            category: [keyword for keyword_lower, keyword in keywords if keyword_lower in text_lower]
+            for category, keywords in CATEGORIES_LOWER.items()
+        }
+
+    matched = {}
+    # A keyword counts once per document, however often it occurs
+    for pairs in {pairs for _, pairs in KEYWORD_AUTOMATON.iter(text_lower)}:
+        for category, keyword in pairs:
+            matched.setdefault(category, []).append(keyword)
+    return matched
+
+
+def has_clear_winner(matched):
+    """True once one category has 2+ keyword hits and more than all others combined"""
+    counts = [len(keywords) for keywords in matched.values()]
+    best = max(counts, default=0)
+    return best >= 2 and best > sum(counts) - best
+
+
+def classify_text(text):
+    """Pick the category whose keywords occur most in the text"""
+    matched = {category: keywords for category, keywords in match_keywords(text.lower()).items() if keywords}
+    if not matched:
+        return "Unclassified"
+
+    logger.debug("Matched keywords: %s", matched)
+    # max() keeps the first category in CATEGORIES order on ties
+    return max(CATEGORIES, key=lambda category: len(matched.get(category, ())))
+
+
+class LRUCache:
+    """Small thread-safe LRU mapping, shared by the request threads of a worker"""
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._data.get(key)
+            if value is not None:
+                self._data.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            if len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+
+# Classification cache keyed on a 16-byte digest instead of the full OCR text
+CLASSIFY_CACHE_SIZE = int(os.getenv("CLASSIFY_CACHE_SIZE", 4096))
+_classify_cache = LRUCache(CLASSIFY_CACHE_SIZE)
+
+# Category of recently processed uploads keyed on their content digest, so
+# re-uploading the same file skips OCR entirely
+DOCUMENT_CACHE_SIZE = int(os.getenv("DOCUMENT_CACHE_SIZE", 4096))
+_document_cache = LRUCache(DOCUMENT_CACHE_SIZE)
 
 
-@lru_cache(maxsize=128)
 def classify(text):
     """Classify text with caching to avoid reprocessing"""
-    text_lower = text.lower()
-    best_match = "Unclassified"
-    max_hits = 0
+    key = hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+    category = _classify_cache.get(key)
+    if category is None:
+        category = classify_text(text)
+        _classify_cache.put(key, category)
+    return category
 
-    for category, keywords in CATEGORIES.items():
-        hits = sum(1 for keyword in keywords if keyword.lower() in text_lower)
-        if hits > 0:
-            print(
-                f"Category: {category}, Hits: {hits}, Matched Keywords: {[keyword for keyword in keywords if keyword.lower() in text_lower]}"
-            )
-        if hits > max_hits:
-            max_hits = hits
-            best_match = category
 
-    return best_match
+def save_stream(src, dst, limit):
+    """Copy src into dst in large chunks, failing once more than limit bytes arrive.
 
+    Returns a digest of the copied content so identical uploads can be
+    recognized without reading the file back.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    total = 0
+    while chunk := src.read(UPLOAD_CHUNK_SIZE):
+        total += len(chunk)
+        if total > limit:
+            raise ValueError("File too large")
+        dst.write(chunk)
+        digest.update(chunk)
+    return digest.digest()
+
+
+def sanitize_name(s):
+    """Sanitize name/lastname for filesystem usage"""
+    return UNSAFE_NAME_CHARS.sub("", s) or "anon"
+
+
+def store_classified_file(tmp_path, ext, name, lastname, category):
+    """Move a spooled upload to the next free name for its category and return that name"""
+    base_name = f"{sanitize_name(name)}_{sanitize_name(lastname)}_{category}"
+
+    os.chmod(tmp_path, 0o644)  # mkstemp creates files owner-only
+
+    # Claim the next free name with O_EXCL so concurrent uploads for the same
+    # person can never pick the same one, then move the upload over it
+    index = 1
+    while True:
+        candidate = f"{base_name}{index}{ext}"
+        path = os.path.join(UPLOAD_FOLDER, candidate)
+        try:
+            os.close(os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644))
+        except FileExistsError:
+            index += 1
+            continue
+        break
 
-def process_single_file(file_data, name, lastname):
+    # Uploads are spooled inside UPLOAD_FOLDER, so this is a rename, not a copy
+    try:
+        os.replace(tmp_path, path)
+    except OSError:
+        # Don't leave the empty placeholder behind, e.g. when the spool file was
+        # already cleaned up after the client disconnected
+        os.remove(path)
+        raise
+    return candidate
+
+
+def process_single_file(file_data, name, lastname, content_digest):
     """Process a single file - designed to run in parallel.
 
-    Expects file_data as (original_name, temp_path). Reads the temp file
-    contents in a controlled way, classifies and optionally stores the file.
+    Expects file_data as (original_name, temp_path) and the digest of its
+    contents. OCRs the temp file, classifies and optionally stores the file.
     Always attempts to remove the temporary file.
     """
     raw_name, tmp_path = file_data
@@ -170,135 +378,208 @@ def process_single_file(file_data, name, lastname):
     filename = secure_filename(raw_name)
 
     try:
-        with open(tmp_path, "rb") as fh:
-            file_bytes = fh.read()
-
-        # Extract text and classify
-        text = extract_text(file_bytes, ext)
-        logger.info("Extracted %d chars from %s", len(text), filename)
-        category = classify(text)
+        category = _document_cache.get(content_digest)
+        if category is None:
+            # Extract text in the OCR process pool and classify
+            text = extract_text(tmp_path, ext)
+            logger.info("Extracted %d chars from %s", len(text), filename)
+            category = classify(text)
+            _document_cache.put(content_digest, category)
+        else:
+            logger.info("Skipping OCR for %s, same content already classified as %s", filename, category)
 
         new_name = None
         if category != "Unclassified":
-            # sanitize name/lastname for filesystem usage
-            def safe_part(s: str) -> str:
-                if not s:
-                    return "anon"
-                safe = "".join(c for c in s if c.isalnum() or c in ('_', '-'))
-                return safe or "anon"
-
-            base_name = f"{safe_part(name)}_{safe_part(lastname)}_{category}"
-
-            # Generate unique filename
-            index = 1
-            while True:
-                candidate = f"{base_name}{index}{ext}"
-                path = os.path.join(UPLOAD_FOLDER, candidate)
-                if not os.path.exists(path):
-                    new_name = candidate
-                    break
-                index += 1
-
-            with open(path, "wb") as f:
-                f.write(file_bytes)
+            new_name = store_classified_file(tmp_path, ext, name, lastname, category)
 
         return {"original_name": filename, "category": category, "new_name": new_name}
     finally:
         try:
-            if os.path.exists(tmp_path):
-                os.remove(tmp_path)
+            os.remove(tmp_path)
         except Exception:
             pass
 
 
-@app.route("/upload", methods=["POST"])
-def upload():
+def process_duplicate_file(file_data, category, name, lastname):
+    """Store a byte-identical copy of an already classified upload, skipping OCR"""
+    raw_name, tmp_path = file_data
+    ext = os.path.splitext(raw_name)[1].lower()
+
+    try:
+        new_name = None
+        if category != "Unclassified":
+            new_name = store_classified_file(tmp_path, ext, name, lastname, category)
+
+        return {"original_name": secure_filename(raw_name), "category": category, "new_name": new_name}
+    finally:
+        try:
+            os.remove(tmp_path)
+        except Exception:
+            pass
+
+
+def remove_temp_files(file_data_list):
+    """Remove any temporary upload files that are still on disk"""
+    for _, tmp_path in file_data_list:
+        try:
+            os.remove(tmp_path)
+        except Exception:
+            pass
+
+
+def remove_stale_uploads():
+    """Remove spool files that a crashed or killed worker left in UPLOAD_FOLDER.
+
+    Uploads are spooled next to the stored files, on the persistent volume, so
+    nothing else would ever clean them up. Only old files are removed, since
+    other gunicorn workers may be spooling uploads right now.
+    """
+    cutoff = time.time() - STALE_UPLOAD_AGE
+    with os.scandir(UPLOAD_FOLDER) as entries:
+        for entry in entries:
+            if not (entry.name.startswith(".upload_") and entry.name.endswith(".tmp")):
+                continue
+            try:
+                if entry.is_file() and entry.stat().st_mtime < cutoff:
+                    os.remove(entry.path)
+                    logger.info("Removed stale upload spool file %s", entry.name)
+            except OSError:
+                pass
+
+
+remove_stale_uploads()
+
+
+def error_response(message, status):
+    """Abort the current request with a JSON error body"""
+    abort(make_response(jsonify({"error": message}), status))
+
+
+@app.errorhandler(413)
+def request_too_large(e):
+    return jsonify({"error": "Request too large"}), 413
+
+
+def read_upload_request():
+    """Validate an upload request and spool its files to disk.
+
+    Returns (name, lastname, file_data_list, duplicates), where duplicates
+    groups the (original_name, temp_path) tuples by content digest. Aborts
+    with a JSON error response if the request is invalid.
+    """
     name = request.form.get("name", "").strip()
     lastname = request.form.get("lastname", "").strip()
 
     if not name or not lastname:
-        return jsonify({"error": "Name and Lastname required"}), 400
-
-    # Basic request size guard
-    content_length = request.content_length
-    if content_length and content_length > MAX_REQUEST_SIZE:
-        return jsonify({"error": "Request too large"}), 413
+        error_response("Name and Lastname required", 400)
 
     files = request.files.getlist("files")
     if not files:
-        return jsonify({"error": "No files provided"}), 400
+        error_response("No files provided", 400)
 
     # Save each uploaded file to a temporary file on disk and validate size
     file_data_list = []  # tuples of (original_name, temp_path)
-    try:
-        for file_storage in files:
-            if not file_storage or not file_storage.filename:
+    duplicates = {}  # content digest -> file_data of identical uploads
+    for file_storage in files:
+        if not file_storage or not file_storage.filename:
+            continue
+
+        original_name = file_storage.filename
+
+        if not allowed_file(original_name):
+            logger.warning("Rejected disallowed file type: %s", original_name)
+            continue
+
+        # Check MIME type if provided
+        content_type = file_storage.mimetype
+        if content_type:
+            if not (content_type.startswith("image/") or content_type == "application/pdf"):
+                logger.warning("Rejected unexpected content-type %s for %s", content_type, original_name)
                 continue
 
-            original_name = file_storage.filename
+        # Stream to a hidden temporary file next to the final location and enforce per-file size
+        tmp_fd, tmp_path = tempfile.mkstemp(prefix=".upload_", suffix=".tmp", dir=UPLOAD_FOLDER)
+        try:
+            with open(tmp_fd, "wb") as out_f:
+                digest = save_stream(file_storage.stream, out_f, MAX_FILE_SIZE)
+        except Exception as e:
+            try:
+                os.remove(tmp_path)
+            except Exception:
+                pass
+            remove_temp_files(file_data_list)
+            logger.exception("Error saving uploaded file %s: %s", original_name, e)
+            error_response("Failed to save uploaded file", 400)
 
-            if not allowed_file(original_name):
-                logger.warning("Rejected disallowed file type: %s", original_name)
-                continue
+        file_data_list.append((original_name, tmp_path))
+        duplicates.setdefault(digest, []).append((original_name, tmp_path))
 
-            # Check MIME type if provided
-            content_type = file_storage.mimetype
-            if content_type:
-                if not (content_type.startswith("image/") or content_type == "application/pdf"):
-                    logger.warning("Rejected unexpected content-type %s for %s", content_type, original_name)
-                    continue
-
-            # Stream to temporary file and enforce per-file size
-            tmp_fd, tmp_path = tempfile.mkstemp(prefix="upload_", suffix=os.path.splitext(original_name)[1])
-            os.close(tmp_fd)
-            total = 0
-            try:
-                with open(tmp_path, "wb") as out_f:
-                    chunk = file_storage.stream.read(8192)
-                    while chunk:
-                        total += len(chunk)
-                        if total > MAX_FILE_SIZE:
-                            raise ValueError("File too large")
-                        out_f.write(chunk)
-                        chunk = file_storage.stream.read(8192)
-            except Exception as e:
-                try:
-                    os.remove(tmp_path)
-                except Exception:
-                    pass
-                logger.exception("Error saving uploaded file %s: %s", original_name, e)
-                return jsonify({"error": "Failed to save uploaded file"}), 400
+    if not file_data_list:
+        error_response("No valid files uploaded", 400)
 
-            file_data_list.append((original_name, tmp_path))
+    return name, lastname, file_data_list, duplicates
 
-        if not file_data_list:
-            return jsonify({"error": "No valid files uploaded"}), 400
 
-        logger.info("Processing %d files in parallel with %d workers", len(file_data_list), MAX_WORKERS)
+def iter_processed_files(file_data_list, duplicates, name, lastname):
+    """Process spooled uploads in parallel and yield each result as it completes.
 
-        # Process files in parallel
-        results = []
-        futures = [executor.submit(process_single_file, file_data, name, lastname) for file_data in file_data_list]
+    OCR runs once per distinct file content. Temporary files are always
+    removed once the generator finishes or is closed.
+    """
+    logger.info(
+        "Processing %d files in parallel with %d workers (%d OCR processes)",
+        len(file_data_list),
+        MAX_WORKERS,
+        OCR_WORKERS,
+    )
+    futures = {}
+    try:
+        futures = {
+            executor.submit(process_single_file, same_files[0], name, lastname, digest): same_files[1:]
+            for digest, same_files in duplicates.items()
+        }
 
         # Collect results as they complete
         for future in as_completed(futures):
             try:
                 res = future.result()
                 if res:
-                    results.append(res)
+                    yield res
+                    for file_data in futures[future]:
+                        yield process_duplicate_file(file_data, res["category"], name, lastname)
             except Exception as e:
                 logger.exception("Error processing file: %s", e)
-
-        logger.info("Completed processing %d files", len(results))
-        return jsonify(results)
     finally:
+        # Don't keep OCRing for a client that went away
+        for future in futures:
+            future.cancel()
         # Cleanup any temporary files that might remain (defensive)
-        for _, tmp_path in file_data_list:
-            try:
-                if os.path.exists(tmp_path):
-                    os.remove(tmp_path)
-            except Exception:
-                pass
+        remove_temp_files(file_data_list)
+
+
+@app.route("/upload", methods=["POST"])
+def upload():
+    name, lastname, file_data_list, duplicates = read_upload_request()
+    results = list(iter_processed_files(file_data_list, duplicates, name, lastname))
+    logger.info("Completed processing %d files", len(results))
+    return jsonify(results)
+
+
+@app.route("/upload_stream", methods=["POST"])
+def upload_stream():
+    """Same as /upload, but streams one JSON result per line as each file finishes"""
+    name, lastname, file_data_list, duplicates = read_upload_request()
+
+    def generate():
+        for res in iter_processed_files(file_data_list, duplicates, name, lastname):
+            yield app.json.dumps(res) + "\n"
+
+    response = Response(generate(), mimetype="application/x-ndjson")
+    # Covers a client that disconnects before the first result was produced
+    response.call_on_close(lambda: remove_temp_files(file_data_list))
+    # Ask nginx to pass lines through instead of buffering the whole response
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
 
 
 @app.route("/files/<filename>")
@@ -306,25 +587,58 @@ def download_file(filename):
     return send_from_directory(UPLOAD_FOLDER, filename, as_attachment=True)
 
 
+class ZipChunkBuffer:
+    """Write-only sink that lets a ZipFile be streamed out chunk by chunk"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def iter_zip(paths):
+    """Yield a ZIP archive of (path, arcname) pairs as it is written"""
+    buffer = ZipChunkBuffer()
+    with zipfile.ZipFile(buffer, "w") as archive:
+        for path, arcname in paths:
+            # Stored as-is: PDF/JPEG/PNG scans are already compressed, so deflate
+            # would burn CPU for a size difference of a percent or two
+            info = zipfile.ZipInfo.from_file(path, arcname)
+            info.compress_type = zipfile.ZIP_STORED
+            with open(path, "rb") as src, archive.open(info, "w") as dst:
+                while chunk := src.read(UPLOAD_CHUNK_SIZE):
+                    dst.write(chunk)
+                    if data := buffer.drain():
+                        yield data
+    yield buffer.drain()
+
+
 @app.route("/download_zip")
 def download_zip():
     name = request.args.get("name", "").strip()
     lastname = request.args.get("lastname", "").strip()
-    prefix = f"{name}_{lastname}_"
-
-    zip_stream = io.BytesIO()
-    with zipfile.ZipFile(zip_stream, "w", zipfile.ZIP_DEFLATED) as archive:
-        for fname in os.listdir(UPLOAD_FOLDER):
-            if fname.startswith(prefix):
-                path = os.path.join(UPLOAD_FOLDER, fname)
-                archive.write(path, arcname=fname)
-
-    zip_stream.seek(0)
-    return send_file(
-        zip_stream,
+    prefix = f"{sanitize_name(name)}_{sanitize_name(lastname)}_"
+
+    # DirEntry caches name and file type from the directory read, so non-matching
+    # files cost no extra syscalls
+    with os.scandir(UPLOAD_FOLDER) as entries:
+        paths = [(entry.path, entry.name) for entry in entries if entry.name.startswith(prefix) and entry.is_file()]
+
+    # Stream the archive as it is built instead of buffering it all in memory
+    return Response(
+        iter_zip(paths),
         mimetype="application/zip",
-        as_attachment=True,
-        download_name="documents.zip",
+        headers={"Content-Disposition": "attachment; filename=documents.zip"},
     )
 
 
@@ -332,10 +646,11 @@ def download_zip():
 def delete_file():
     filename = request.args.get("filename", "")
     path = os.path.join(UPLOAD_FOLDER, filename)
-    if os.path.exists(path):
+    try:
         os.remove(path)
-        return jsonify({"status": "deleted"})
-    return jsonify({"error": "File not found"}), 404
+    except FileNotFoundError:
+        return jsonify({"error": "File not found"}), 404
+    return jsonify({"status": "deleted"})
 
 
 # Serve Flutter web app